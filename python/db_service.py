@@ -0,0 +1,441 @@
+from __future__ import annotations
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+DB_PATH = "lobx.db"
+BUSY_TIMEOUT_MS = 5000
+MMAP_SIZE = 30000000000
+READ_POOL_SIZE = 4
+BATCH_MAX = 512             # ops per write transaction
+BATCH_WAIT_S = 0.05         # how long the writer waits to fill a batch
+CKPT_IDLE_S = 1.0           # writer idle time before a PASSIVE checkpoint
+CKPT_PASSIVE_BYTES = 16 * 1024 * 1024    # un-checkpointed WAL content
+CKPT_RESTART_BYTES = 256 * 1024 * 1024   # total WAL content
+CKPT_RESTART_WAIT_MS = 200  # busy wait for readers during RESTART
+CKPT_RETRY_S = 5.0          # back-off after a checkpoint held up by readers
+CKPT_POLL_S = 0.25
+WAL_FRAME_HDR = 24
+
+
+def _apply_pragmas(con: sqlite3.Connection, read_only: bool) -> None:
+    con.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS};")
+    con.execute("PRAGMA temp_store=MEMORY;")
+    con.execute(f"PRAGMA mmap_size={MMAP_SIZE};")
+    if read_only:
+        con.execute("PRAGMA query_only=ON;")
+    else:
+        con.execute("PRAGMA journal_mode=WAL;")
+        con.execute("PRAGMA synchronous=NORMAL;")
+        con.execute("PRAGMA foreign_keys=ON;")
+        # checkpoints are driven by WriterService, not by commit size;
+        # the size limit shrinks the -wal file whenever the WAL is reset
+        con.execute("PRAGMA wal_autocheckpoint=0;")
+        con.execute(f"PRAGMA journal_size_limit={CKPT_PASSIVE_BYTES};")
+
+
+def wal_size_bytes(db_path: str = DB_PATH) -> int:
+    """Size of the -wal file on disk; it only shrinks when the WAL is reset."""
+    try:
+        return os.path.getsize(db_path + "-wal")
+    except OSError:
+        return 0
+
+
+def wal_frames(db_path: str = DB_PATH) -> Optional[Tuple[int, int]]:
+    """
+    (frames in the WAL, frames already checkpointed) read from the wal-index
+    header in the -shm file (mxFrame and nBackfill, see
+    https://www.sqlite.org/walformat.html). None if it cannot be read.
+    """
+    try:
+        with open(db_path + "-shm", "rb") as f:
+            hdr = f.read(100)
+    except OSError:
+        return None
+    if len(hdr) < 100:
+        return None
+    mx = int.from_bytes(hdr[16:20], sys.byteorder)
+    backfill = int.from_bytes(hdr[96:100], sys.byteorder)
+    return mx, min(backfill, mx)
+
+
+class _PooledConnection(sqlite3.Connection):
+    """Connection that remembers every cursor opened on it."""
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._cursors: "weakref.WeakSet[sqlite3.Cursor]" = weakref.WeakSet()
+
+    def cursor(self, *args: Any, **kwargs: Any) -> sqlite3.Cursor:
+        cur = super().cursor(*args, **kwargs)
+        self._cursors.add(cur)
+        return cur
+
+    # the C shortcuts build their cursor without calling cursor()
+    def execute(self, sql: str, params: Any = ()) -> sqlite3.Cursor:
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql: str, params: Any) -> sqlite3.Cursor:
+        return self.cursor().executemany(sql, params)
+
+    def executescript(self, script: str) -> sqlite3.Cursor:
+        return self.cursor().executescript(script)
+
+    def _release(self) -> None:
+        for cur in list(self._cursors):
+            cur.close()
+        self._cursors.clear()
+        if self.in_transaction:
+            self.rollback()
+
+
+class ReadPool:
+    """
+    Fixed set of read-only connections, pragmas applied once at open.
+    Borrow one with `with pool.connection() as con:`; cursors the borrower
+    left open are closed when the connection is handed back.
+    """
+
+    def __init__(self, db_path: str = DB_PATH, size: int = READ_POOL_SIZE) -> None:
+        self.db_path = db_path
+        self._idle: "queue.LifoQueue[_PooledConnection]" = queue.LifoQueue()
+        self._all: List[_PooledConnection] = []
+        for _ in range(size):
+            con = sqlite3.connect(
+                f"file:{db_path}?mode=ro", uri=True, check_same_thread=False,
+                factory=_PooledConnection,
+            )
+            _apply_pragmas(con, read_only=True)
+            con.row_factory = sqlite3.Row
+            self._all.append(con)
+            self._idle.put(con)
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None) -> Iterator[sqlite3.Connection]:
+        con = self._idle.get(timeout=timeout)
+        try:
+            yield con
+        finally:
+            # a partially read SELECT holds its read snapshot even though
+            # sqlite3 reports no transaction; it would pin the WAL and hold
+            # back checkpoints, so close every cursor the borrower opened
+            con._release()
+            self._idle.put(con)
+
+    def close(self) -> None:
+        for con in self._all:
+            con.close()
+        self._all.clear()
+
+    def __enter__(self) -> "ReadPool":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+_Op = Tuple[str, str, Any, Future]
+_STOP = ("stop", "", None, None)
+
+
+class WriterService(threading.Thread):
+    """
+    Single thread that owns the only write connection to the database.
+    Callers enqueue statements and get a Future back; queued statements are
+    committed together in one transaction of up to BATCH_MAX ops, each op in
+    its own savepoint so a bad statement only fails its own Future.
+    Between batches the thread runs a PASSIVE checkpoint once the writer has
+    been idle for CKPT_IDLE_S or un-checkpointed WAL content passes
+    CKPT_PASSIVE_BYTES, and a RESTART checkpoint (short busy wait) when
+    readers have kept the WAL from resetting past CKPT_RESTART_BYTES. Either
+    is retried only after CKPT_RETRY_S if readers held it up. Sizes come from
+    WAL frame counts, not the -wal file, which does not shrink on its own.
+    """
+
+    def __init__(self, db_path: str = DB_PATH) -> None:
+        super().__init__(name="lobx-writer", daemon=True)
+        self.db_path = db_path
+        self._q: "queue.Queue[_Op]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Any] = {
+            "batches": 0,
+            "ops": 0,
+            "op_errors": 0,
+            "checkpoints_passive": 0,
+            "checkpoints_full": 0,
+            "checkpoints_restart": 0,
+            "checkpoints_truncate": 0,
+            "checkpoints_busy": 0,
+            "wal_frames": 0,
+            "wal_frames_checkpointed": 0,
+            "last_commit_unix": None,
+            "last_checkpoint_unix": None,
+        }
+        self._ready = threading.Event()
+        self._start_error: Optional[BaseException] = None
+        self._closing = False
+        self._inflight: List[_Op] = []
+        self._frame_bytes = 0
+        self._started_unix = time.time()
+        self._restart_after = 0.0
+        self._passive_after = 0.0
+
+    def start(self) -> "WriterService":
+        super().start()
+        self._ready.wait()
+        if self._start_error is not None:
+            raise self._start_error
+        return self
+
+    def execute(self, sql: str, params: Sequence[Any] = ()) -> Future:
+        return self._submit("one", sql, params)
+
+    def executemany(self, sql: str, rows: Sequence[Sequence[Any]]) -> Future:
+        return self._submit("many", sql, rows)
+
+    def executescript(self, script: str) -> Future:
+        """Runs outside the batch transaction; use for DDL such as sql/*.sql."""
+        return self._submit("script", script, None)
+
+    def checkpoint(self, mode: str = "PASSIVE") -> Future:
+        return self._submit("checkpoint", mode, None)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        with self._lock:
+            if not self._closing:
+                self._closing = True
+                self._q.put(_STOP)
+        if self.is_alive():
+            self.join(timeout)
+
+    def __enter__(self) -> "WriterService":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            out = dict(self._stats)
+        now = time.time()
+        out["wal_bytes"] = wal_size_bytes(self.db_path)
+        out["queue_depth"] = self._q.qsize()
+        log, ckpt = self._wal_state()
+        out["wal_frames"] = log
+        out["wal_frames_checkpointed"] = ckpt
+        # frames committed to the WAL but not yet copied back into the db file
+        out["checkpoint_lag_frames"] = log - ckpt
+        out["checkpoint_lag_bytes"] = (log - ckpt) * self._frame_bytes
+        # how long those frames have been waiting: time since the last
+        # checkpoint that copied everything
+        last = out["last_checkpoint_unix"] or self._started_unix
+        out["checkpoint_lag_s"] = now - last if log > ckpt else 0.0
+        return out
+
+    def _submit(self, kind: str, sql: str, payload: Any) -> Future:
+        fut: Future = Future()
+        # checked under the lock close() takes, so nothing lands behind _STOP
+        with self._lock:
+            if self._closing or not self.is_alive():
+                raise RuntimeError("WriterService is not running")
+            self._q.put((kind, sql, payload, fut))
+        return fut
+
+    def _fail_pending(self) -> None:
+        with self._lock:
+            self._closing = True
+        err = RuntimeError("WriterService stopped")
+        pending = self._inflight
+        self._inflight = []
+        while True:
+            try:
+                pending.append(self._q.get_nowait())
+            except queue.Empty:
+                break
+        for op in pending:
+            fut = op[3]
+            if fut is not None and not fut.done():
+                fut.set_exception(err)
+
+    def run(self) -> None:
+        try:
+            con = sqlite3.connect(self.db_path, isolation_level=None)
+            _apply_pragmas(con, read_only=False)
+            page_size = con.execute("PRAGMA page_size;").fetchone()[0]
+            self._frame_bytes = int(page_size) + WAL_FRAME_HDR
+        except BaseException as e:
+            self._start_error = e
+            self._closing = True
+            self._ready.set()
+            return
+        self._ready.set()
+        last_write = time.monotonic()
+        dirty = False
+        try:
+            while True:
+                try:
+                    first = self._q.get(timeout=CKPT_POLL_S)
+                except queue.Empty:
+                    now = time.monotonic()
+                    if (dirty and now - last_write >= CKPT_IDLE_S
+                            and now >= self._passive_after):
+                        # stay dirty until every frame is copied; a reader
+                        # holding a snapshot gets retried after CKPT_RETRY_S
+                        dirty = not self._maybe_checkpoint(con, idle=True)
+                    continue
+                batch = [first]
+                deadline = time.monotonic() + BATCH_WAIT_S
+                while len(batch) < BATCH_MAX and batch[-1] is not _STOP:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(self._q.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+                stop = batch[-1] is _STOP
+                if stop:
+                    batch.pop()
+                if batch:
+                    self._inflight = batch
+                    self._run_batch(con, batch)
+                    self._inflight = []
+                    last_write = time.monotonic()
+                    dirty = True
+                    self._maybe_checkpoint(con, idle=False)
+                if stop:
+                    break
+            # reclaim the -wal file; if this is the last connection SQLite
+            # also removes -wal and -shm on close
+            self._checkpoint(con, "TRUNCATE")
+        finally:
+            self._fail_pending()
+            con.close()
+
+    def _run_batch(self, con: sqlite3.Connection, batch: List[_Op]) -> None:
+        txn: List[_Op] = []
+        for op in batch:
+            kind = op[0]
+            if kind in ("one", "many"):
+                txn.append(op)
+                continue
+            # scripts and explicit checkpoints cannot run inside a transaction
+            self._commit(con, txn)
+            txn = []
+            _, sql, _, fut = op
+            try:
+                if kind == "script":
+                    con.executescript(sql)
+                    fut.set_result(None)
+                else:
+                    fut.set_result(self._checkpoint(con, sql))
+            except Exception as e:
+                fut.set_exception(e)
+        self._commit(con, txn)
+
+    def _commit(self, con: sqlite3.Connection, ops: List[_Op]) -> None:
+        if not ops:
+            return
+        results: List[Tuple[Future, Any, Optional[BaseException]]] = []
+        try:
+            con.execute("BEGIN IMMEDIATE;")
+            for kind, sql, payload, fut in ops:
+                con.execute("SAVEPOINT op;")
+                try:
+                    if kind == "one":
+                        cur = con.execute(sql, payload)
+                    else:
+                        cur = con.executemany(sql, payload)
+                    con.execute("RELEASE op;")
+                    results.append((fut, cur.rowcount, None))
+                except Exception as e:
+                    # bind errors (OverflowError, ...) are per-op failures too
+                    con.execute("ROLLBACK TO op;")
+                    con.execute("RELEASE op;")
+                    results.append((fut, None, e))
+            con.execute("COMMIT;")
+        except Exception as e:
+            if con.in_transaction:
+                con.execute("ROLLBACK;")
+            for _, _, _, fut in ops:
+                fut.set_exception(e)
+            return
+        n_err = sum(1 for _, _, err in results if err is not None)
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["ops"] += len(ops)
+            self._stats["op_errors"] += n_err
+            self._stats["last_commit_unix"] = time.time()
+        for fut, value, err in results:
+            if err is None:
+                fut.set_result(value)
+            else:
+                fut.set_exception(err)
+
+    def _wal_state(self) -> Tuple[int, int]:
+        live = wal_frames(self.db_path)
+        if live is not None:
+            return live
+        # no readable -shm: fall back to what the last checkpoint reported
+        with self._lock:
+            return self._stats["wal_frames"], self._stats["wal_frames_checkpointed"]
+
+    def _maybe_checkpoint(self, con: sqlite3.Connection, idle: bool) -> bool:
+        """Returns True when every WAL frame has been copied back."""
+        log, ckpt = self._wal_state()
+        pending_bytes = (log - ckpt) * self._frame_bytes
+        now = time.monotonic()
+        # a WAL this long after backfill means readers kept it from resetting
+        if log * self._frame_bytes >= CKPT_RESTART_BYTES and now >= self._restart_after:
+            busy, log, ckpt = self._checkpoint(con, "RESTART")
+            if busy:
+                self._restart_after = time.monotonic() + CKPT_RETRY_S
+        elif (idle and log > ckpt) or (
+                pending_bytes >= CKPT_PASSIVE_BYTES and now >= self._passive_after):
+            _, log, ckpt = self._checkpoint(con, "PASSIVE")
+            if ckpt < log:
+                self._passive_after = time.monotonic() + CKPT_RETRY_S
+        return ckpt >= log
+
+    def _checkpoint(self, con: sqlite3.Connection, mode: str) -> Tuple[int, int, int]:
+        mode = mode.upper()
+        if mode not in ("PASSIVE", "FULL", "RESTART", "TRUNCATE"):
+            raise ValueError(f"unknown checkpoint mode: {mode}")
+        if mode == "PASSIVE":
+            busy, log, ckpt = con.execute("PRAGMA wal_checkpoint(PASSIVE);").fetchone()
+        else:
+            # blocking modes wait on readers; keep that wait short so a
+            # long-lived reader cannot stall the write queue
+            con.execute(f"PRAGMA busy_timeout={CKPT_RESTART_WAIT_MS};")
+            try:
+                busy, log, ckpt = con.execute(f"PRAGMA wal_checkpoint({mode});").fetchone()
+            finally:
+                con.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS};")
+        with self._lock:
+            self._stats[f"checkpoints_{mode.lower()}"] += 1
+            self._stats["checkpoints_busy"] += int(busy)
+            self._stats["wal_frames"] = max(int(log), 0)
+            self._stats["wal_frames_checkpointed"] = max(int(ckpt), 0)
+            # PASSIVE never reports busy; only a full copy clears the lag
+            if not busy and ckpt == log:
+                self._stats["last_checkpoint_unix"] = time.time()
+        return int(busy), int(log), int(ckpt)
+
+
+def main() -> None:
+    with WriterService(DB_PATH) as w:
+        w.checkpoint("PASSIVE").result()
+        print(json.dumps(w.metrics(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
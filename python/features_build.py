@@ -1,10 +1,12 @@
 from __future__ import annotations
 import json
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Dict, Any
 import numpy as np
 import pandas as pd
+from db_service import ReadPool, WriterService
 
 DB_PATH = "lobx.db"
 OUT_DIR_DATA = Path("data")
@@ -15,14 +17,6 @@ HORIZON_S = 30
 MIN_ROLL = 5    
 
 
-def _connect(db_path: str) -> sqlite3.Connection:
-    con = sqlite3.connect(db_path)
-    con.execute("PRAGMA journal_mode=WAL;")
-    con.execute("PRAGMA synchronous=NORMAL;")
-    con.row_factory = sqlite3.Row
-    return con
-
-
 def _read_base(con: sqlite3.Connection) -> pd.DataFrame:
     """
     Bring in per-minute base features plus last close from rolling_vol_5m
@@ -157,12 +151,19 @@ def _roll_std_gby(series: pd.Series, win: int, min_req: int | None = None) -> pd
 
 
 def main() -> None:
-    con = _connect(DB_PATH)
-    base   = _read_base(con)
-    nxt    = _read_next30_mid(con)
-    taker  = _read_taker_trade_flow(con)
-    topq   = _read_top1_qty(con)
-    con.close()
+    readers = [_read_base, _read_next30_mid, _read_taker_trade_flow, _read_top1_qty]
+
+    def _run(reader):
+        with pool.connection() as con:
+            return reader(con)
+
+    # independent read-only queries, one pooled connection each
+    with ReadPool(DB_PATH, size=len(readers)) as pool, \
+         ThreadPoolExecutor(max_workers=len(readers)) as ex:
+        base, nxt, taker, topq = ex.map(_run, readers)
+    # read-only connections cannot remove lobx.db-wal/-shm on close;
+    # the writer's shutdown checkpoint does
+    WriterService(DB_PATH).start().close()
     df = (
         base.merge(nxt,  on=["symbol","bucket_ms"], how="left")
             .merge(taker,on=["symbol","bucket_ms"], how="left")
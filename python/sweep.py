@@ -0,0 +1,358 @@
+from __future__ import annotations
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+import pandas as pd
+
+OUT_DIR_DATA = Path("data")
+OUT_DIR_MODELS = Path("models")
+FEATURES_PARQUET = OUT_DIR_DATA / "features.parquet"
+FEATURES_CSV = OUT_DIR_DATA / "features.csv"
+SCHEMA_PATH = OUT_DIR_MODELS / "feature_schema.json"
+CACHE_DIR = OUT_DIR_MODELS / "sweep_cache"
+RESULTS_PATH = OUT_DIR_MODELS / "sweep_results.csv"
+N_FOLDS = 5
+MAX_ITER = 100
+TOL = 1e-8
+SOLVER = "newton-l2/1"      # bump when _fit_logreg changes, invalidates the cache
+DEFAULT_CS = [float(c) for c in np.logspace(-3, 2, 12)]
+CLASS_WEIGHTS = ("none", "balanced")
+# BLAS thread pools, capped to one thread per worker process
+BLAS_THREAD_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+
+# per-process state, filled by _init_worker
+_W: Dict[str, Any] = {}
+
+
+def _load_matrix(schema: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Load features once and standardize the full matrix in place.
+    Label is direction_next_30s > 0 (up vs flat/down).
+    """
+    try:
+        df = pd.read_parquet(FEATURES_PARQUET)
+    except Exception:
+        df = pd.read_csv(FEATURES_CSV)
+    df = df.sort_values(schema["index_cols"][::-1]).reset_index(drop=True)
+    X = np.ascontiguousarray(df[schema["feature_cols"]].to_numpy(dtype=np.float64))
+    y = (df[schema["label_col"]].to_numpy() > 0).astype(np.float64)
+    mu = X.mean(axis=0)
+    sd = X.std(axis=0)
+    sd[sd == 0] = 1.0
+    X -= mu
+    X /= sd
+    return X, y
+
+
+def _fingerprint(X: np.ndarray, y: np.ndarray) -> str:
+    h = hashlib.sha1()
+    h.update(str(X.shape).encode())
+    # both arrays are C-contiguous; hash their buffers without copying
+    h.update(memoryview(X))
+    h.update(memoryview(y))
+    h.update(f"folds={N_FOLDS}".encode())
+    return h.hexdigest()[:16]
+
+
+def _config_hash(C: float, class_weight: Optional[str], features: Sequence[str], fp: str) -> str:
+    payload = {
+        "C": repr(float(C)),
+        "class_weight": class_weight,
+        "features": list(features),
+        "data": fp,
+        "solver": [SOLVER, MAX_ITER, repr(TOL)],
+    }
+    return hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:20]
+
+
+def _share(arr: np.ndarray) -> Tuple[shared_memory.SharedMemory, Tuple[str, Tuple[int, ...], str]]:
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    view = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)
+    view[...] = arr
+    return shm, (shm.name, arr.shape, arr.dtype.str)
+
+
+def _attach(spec: Tuple[str, Tuple[int, ...], str]) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    arr = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    arr.flags.writeable = False
+    return shm, arr
+
+
+def _folds(n: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+    # contiguous time blocks, no shuffling across the time axis
+    blocks = np.array_split(np.arange(n), N_FOLDS)
+    out = []
+    for k, va in enumerate(blocks):
+        if len(va) == 0:
+            continue
+        tr = np.concatenate([b for j, b in enumerate(blocks) if j != k])
+        out.append((tr, va))
+    return out
+
+
+def _init_worker(x_spec, y_spec, feature_cols: List[str], fp: str) -> None:
+    x_shm, X = _attach(x_spec)
+    y_shm, y = _attach(y_spec)
+    _W.update(
+        x_shm=x_shm, y_shm=y_shm, X=X, y=y, fp=fp,
+        col_idx={c: i for i, c in enumerate(feature_cols)},
+        folds=_folds(X.shape[0]),
+    )
+
+
+def _sample_weights(y: np.ndarray, class_weight: Optional[str]) -> np.ndarray:
+    if class_weight is None:
+        return np.ones_like(y)
+    if class_weight != "balanced":
+        raise ValueError(f"unknown class_weight: {class_weight}")
+    n_pos = y.sum()
+    n_neg = len(y) - n_pos
+    w_pos = len(y) / (2.0 * n_pos) if n_pos else 0.0
+    w_neg = len(y) / (2.0 * n_neg) if n_neg else 0.0
+    return np.where(y > 0, w_pos, w_neg)
+
+
+def _sigmoid(z: np.ndarray) -> np.ndarray:
+    return 0.5 * (1.0 + np.tanh(0.5 * z))
+
+
+def _fit_logreg(
+    Xb: np.ndarray, y: np.ndarray, s: np.ndarray, C: float, coef0: Optional[np.ndarray]
+) -> Tuple[np.ndarray, int, bool]:
+    """
+    L2 logistic regression, C * sum(s_i * logloss_i) + 0.5 * ||w||^2, fitted
+    by damped Newton. Xb carries the intercept in column 0 (not penalized).
+    Returns (coef, iterations, converged).
+    """
+    d = Xb.shape[1]
+    pen = np.ones(d)
+    pen[0] = 1e-10
+    coef = np.zeros(d) if coef0 is None else coef0.copy()
+
+    def _obj(c: np.ndarray) -> float:
+        z = Xb @ c
+        ll = np.logaddexp(0.0, z) - y * z
+        return C * float(s @ ll) + 0.5 * float(pen @ (c * c))
+
+    f = _obj(coef)
+    for it in range(1, MAX_ITER + 1):
+        p = _sigmoid(Xb @ coef)
+        grad = C * (Xb.T @ (s * (p - y))) + pen * coef
+        H = C * (Xb.T * (s * p * (1.0 - p))) @ Xb
+        H[np.diag_indices(d)] += pen
+        step = np.linalg.solve(H, grad)
+        t = 1.0
+        while True:
+            cand = coef - t * step
+            f_new = _obj(cand)
+            if f_new <= f or t < 1e-6:
+                break
+            t *= 0.5
+        coef, f_prev, f = cand, f, f_new
+        if abs(f_prev - f) <= TOL * max(1.0, abs(f)):
+            return coef, it, True
+    return coef, MAX_ITER, False
+
+
+def _auc(y: np.ndarray, p: np.ndarray) -> float:
+    n_pos = int(y.sum())
+    n_neg = len(y) - n_pos
+    if n_pos == 0 or n_neg == 0:
+        return float("nan")
+    ranks = pd.Series(p).rank().to_numpy()
+    return float((ranks[y > 0].sum() - n_pos * (n_pos + 1) / 2.0) / (n_pos * n_neg))
+
+
+def _score(Xb: np.ndarray, y: np.ndarray, coef: np.ndarray) -> Dict[str, float]:
+    z = Xb @ coef
+    p = _sigmoid(z)
+    return {
+        "logloss": float(np.mean(np.logaddexp(0.0, z) - y * z)),
+        "accuracy": float(np.mean((p >= 0.5) == (y > 0))),
+        "auc": _auc(y, p),
+    }
+
+
+def _write_json_atomic(path: Path, obj: Dict[str, Any]) -> None:
+    tmp = path.with_suffix(f".tmp{os.getpid()}")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f)
+    os.replace(tmp, path)
+
+
+def _design(X: np.ndarray, rows: np.ndarray, cols: List[int]) -> np.ndarray:
+    """
+    X[rows][:, cols] behind a column of ones, gathered straight into one
+    column-major array so each worker holds a single copy per fold.
+    """
+    out = np.empty((len(rows), len(cols) + 1), order="F")
+    out[:, 0] = 1.0
+    for j, c in enumerate(cols, 1):
+        np.take(X[:, c], rows, out=out[:, j], mode="clip")
+    return out
+
+
+def _run_path(class_weight: Optional[str], features: Tuple[str, ...], Cs: List[float]) -> List[Dict[str, Any]]:
+    """
+    Fit one (class_weight, feature subset) over every C and fold. Cs are
+    walked from strongest to weakest regularization, each fit warm-started
+    from the previous one; fold results already on disk are reused, and
+    still seed the warm start for the next C.
+    """
+    X, y, fp = _W["X"], _W["y"], _W["fp"]
+    cols = [_W["col_idx"][c] for c in features]
+    keys = [_config_hash(C, class_weight, features, fp) for C in Cs]
+    out = []
+    for k, (tr, va) in enumerate(_W["folds"]):
+        coef = None
+        Xtr = ytr = s = Xva = None
+        for C, key in zip(Cs, keys):
+            path = CACHE_DIR / f"{key}_f{k}.json"
+            if path.exists():
+                rec = json.loads(path.read_text(encoding="utf-8"))
+                coef = np.asarray(rec["coef"])
+                out.append(rec)
+                continue
+            if Xtr is None:
+                Xtr = _design(X, tr, cols)
+                ytr = y[tr]
+                s = _sample_weights(ytr, class_weight)
+                s = s / s.sum()
+                Xva = _design(X, va, cols)
+            t0 = time.perf_counter()
+            coef, n_iter, converged = _fit_logreg(Xtr, ytr, s, C, coef)
+            rec = {
+                "config_hash": key,
+                "fold": k,
+                "C": C,
+                "class_weight": class_weight,
+                "n_features": len(features),
+                "n_iter": n_iter,
+                "converged": converged,
+                "fit_s": time.perf_counter() - t0,
+                **_score(Xva, y[va], coef),
+                "coef": coef.tolist(),
+            }
+            _write_json_atomic(path, rec)
+            out.append(rec)
+    return out
+
+
+def _feature_subsets(
+    feature_cols: List[str], drop_one: bool, n_random: int, subset_size: int, seed: int
+) -> List[Tuple[str, ...]]:
+    subsets = [tuple(feature_cols)]
+    if drop_one:
+        subsets += [tuple(c for c in feature_cols if c != d) for d in feature_cols]
+    rng = random.Random(seed)
+    k = min(subset_size, len(feature_cols))
+    for _ in range(n_random):
+        picked = set(rng.sample(feature_cols, k))
+        subsets.append(tuple(c for c in feature_cols if c in picked))
+    seen = set()
+    return [s for s in subsets if not (s in seen or seen.add(s))]
+
+
+def _parse_args() -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description="Logistic regression hyperparameter / feature-subset sweep")
+    ap.add_argument("--C", type=lambda v: [float(x) for x in v.split(",")], default=DEFAULT_CS,
+                    help="comma-separated inverse regularization strengths")
+    ap.add_argument("--class-weight", default=",".join(CLASS_WEIGHTS),
+                    help="comma-separated subset of " + ",".join(CLASS_WEIGHTS))
+    ap.add_argument("--drop-one", action="store_true", help="add every leave-one-feature-out subset")
+    ap.add_argument("--random-subsets", type=int, default=0)
+    ap.add_argument("--subset-size", type=int, default=15)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = ap.parse_args()
+    weights = [w.strip().lower() for w in args.class_weight.split(",") if w.strip()]
+    bad = [w for w in weights if w not in CLASS_WEIGHTS]
+    if bad or not weights:
+        ap.error(f"--class-weight: expected values from {','.join(CLASS_WEIGHTS)}, got {args.class_weight!r}")
+    args.class_weight = [None if w == "none" else w for w in dict.fromkeys(weights)]
+    return args
+
+
+def main() -> None:
+    args = _parse_args()
+    with open(SCHEMA_PATH, encoding="utf-8") as f:
+        schema = json.load(f)
+    feature_cols = list(schema["feature_cols"])
+    X, y = _load_matrix(schema)
+    fp = _fingerprint(X, y)
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+
+    Cs = sorted(set(args.C))
+    weights = args.class_weight
+    subsets = _feature_subsets(feature_cols, args.drop_one, args.random_subsets,
+                               args.subset_size, args.seed)
+    tasks = [(w, s) for w in weights for s in subsets]
+    print(f"[sweep] rows={X.shape[0]} configs={len(tasks) * len(Cs)} paths={len(tasks)} data={fp}")
+
+    x_shm, x_spec = _share(X)
+    y_shm, y_spec = _share(y)
+    del X, y
+    records: List[Dict[str, Any]] = []
+    subset_of: Dict[str, Tuple[str, ...]] = {}
+    t0 = time.perf_counter()
+    # spawned workers import numpy fresh and pick these up; a forked worker
+    # would inherit this process's BLAS pool, giving ~workers^2 threads
+    for var in BLAS_THREAD_VARS:
+        os.environ[var] = "1"
+    try:
+        with ProcessPoolExecutor(
+            max_workers=args.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(x_spec, y_spec, feature_cols, fp),
+        ) as ex:
+            futs = {ex.submit(_run_path, w, s, Cs): s for w, s in tasks}
+            for i, fut in enumerate(as_completed(futs), 1):
+                recs = fut.result()
+                for r in recs:
+                    subset_of[r["config_hash"]] = futs[fut]
+                records.extend(recs)
+                if i % 10 == 0 or i == len(futs):
+                    print(f"[sweep] paths {i}/{len(futs)} elapsed={time.perf_counter() - t0:.1f}s")
+    finally:
+        x_shm.close()
+        x_shm.unlink()
+        y_shm.close()
+        y_shm.unlink()
+
+    folds = pd.DataFrame.from_records(records).drop(columns=["coef"])
+    res = (
+        folds.groupby("config_hash", sort=False)
+             .agg(C=("C", "first"), class_weight=("class_weight", "first"),
+                  n_features=("n_features", "first"), folds=("fold", "count"),
+                  logloss=("logloss", "mean"), logloss_std=("logloss", "std"),
+                  accuracy=("accuracy", "mean"), auc=("auc", "mean"),
+                  n_iter=("n_iter", "sum"), converged=("converged", "all"))
+             .reset_index()
+    )
+    res["class_weight"] = res["class_weight"].fillna("none")
+    all_cols = set(feature_cols)
+    res["dropped"] = [",".join(sorted(all_cols - set(subset_of[h]))) for h in res["config_hash"]]
+    res["features"] = [",".join(subset_of[h]) for h in res["config_hash"]]
+    # configs where any fold hit MAX_ITER rank after every converged one
+    res = res.sort_values(["converged", "logloss", "n_features"],
+                          ascending=[False, True, True]).reset_index(drop=True)
+    res.to_csv(RESULTS_PATH, index=False)
+    print(res.head(10)[["C", "class_weight", "n_features", "logloss", "accuracy", "auc",
+                        "converged", "dropped"]])
+    print(f"[sweep] configs={len(res)} unconverged={int((~res['converged']).sum())} wrote={RESULTS_PATH}")
+
+
+if __name__ == "__main__":
+    main()